@@ -8,6 +8,11 @@ class Settings:
     
     # Supported formats
     SUPPORTED_FORMATS = ['jpg', 'jpeg', 'png', 'bmp', 'tiff']
+    SUPPORTED_FORMAT_SET = frozenset(map(str.lower, SUPPORTED_FORMATS))
+    
+    # Batch output formats, the first one is the default
+    OUTPUT_FORMATS = ['jpg', 'png']
+    JPEG_QUALITY = 92
     
     # Processing limits
     MAX_IMAGE_SIZE = 2000  # pixels
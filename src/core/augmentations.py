@@ -2,89 +2,171 @@
 
 import cv2
 import numpy as np
-from PIL import Image, ImageEnhance, ImageFilter
-from src.utils.helpers import pil_to_cv2, cv2_to_pil
+
+# ITU-R 601 luma weights, as used by PIL's "L" conversion
+_LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+def _scratch_buffer(scratch, name, shape, dtype=np.uint8):
+    """Return a reusable buffer from a scratch dict, or a fresh one if there is none"""
+    if scratch is None:
+        return np.empty(shape, dtype)
+    key = (shape, np.dtype(dtype), name)
+    buffer = scratch.get(key)
+    if buffer is None:
+        buffer = scratch[key] = np.empty(shape, dtype)
+    return buffer
 
 class AugmentationEngine:
-    """Core image augmentation engine"""
+    """Core image augmentation engine
+    
+    All operations take and return RGB uint8 numpy arrays. The color operations
+    also work in BGR order when passed bgr=True; the others treat every channel alike.
+    """
     
     @staticmethod
     def rotate(image, angle):
         """Rotate image by angle degrees"""
-        if angle == 0:
-            return image
-        image_cv = pil_to_cv2(image)
-        (h, w) = image_cv.shape[:2]
-        center = (w // 2, h // 2)
-        matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
-        rotated = cv2.warpAffine(image_cv, matrix, (w, h))
-        return cv2_to_pil(rotated)
+        return AugmentationEngine.geometric_transform(image, angle)
     
     @staticmethod
     def flip_horizontal(image):
         """Flip image horizontally"""
-        return image.transpose(Image.FLIP_LEFT_RIGHT)
+        return cv2.flip(image, 1)
     
     @staticmethod
     def flip_vertical(image):
         """Flip image vertically"""
-        return image.transpose(Image.FLIP_TOP_BOTTOM)
+        return cv2.flip(image, 0)
     
     @staticmethod
     def adjust_brightness(image, factor):
         """Adjust image brightness"""
-        enhancer = ImageEnhance.Brightness(image)
-        return enhancer.enhance(factor)
+        return cv2.convertScaleAbs(image, alpha=factor)
     
     @staticmethod
     def adjust_contrast(image, factor):
         """Adjust image contrast"""
-        enhancer = ImageEnhance.Contrast(image)
-        return enhancer.enhance(factor)
+        return AugmentationEngine.color_transform(image, contrast=factor)
     
     @staticmethod
     def adjust_saturation(image, factor):
         """Adjust image saturation"""
-        enhancer = ImageEnhance.Color(image)
-        return enhancer.enhance(factor)
+        return AugmentationEngine.color_transform(image, saturation=factor)
     
     @staticmethod
     def adjust_sharpness(image, factor):
         """Adjust image sharpness"""
-        enhancer = ImageEnhance.Sharpness(image)
-        return enhancer.enhance(factor)
+        return AugmentationEngine.color_transform(image, sharpness=factor)
+    
+    @staticmethod
+    def geometric_transform(image, angle=0, flip_horizontal=False, flip_vertical=False, scratch=None):
+        """Rotate and flip image with a single affine warp"""
+        (h, w) = image.shape[:2]
+        
+        # Right angles are exact pixel moves, so skip resampling. Quarter turns only
+        # keep the canvas on square images; elsewhere they still go through the warp
+        quarter_turns = int(angle // 90) % 4 if angle % 90 == 0 else None
+        if quarter_turns in (0, 2) or (quarter_turns in (1, 3) and h == w):
+            if quarter_turns == 2:
+                # A half turn is a flip on both axes
+                flip_horizontal, flip_vertical = not flip_horizontal, not flip_vertical
+            result = image
+            dst = _scratch_buffer(scratch, 'warp', image.shape)
+            if quarter_turns in (1, 3):
+                rotate_code = cv2.ROTATE_90_COUNTERCLOCKWISE if quarter_turns == 1 else cv2.ROTATE_90_CLOCKWISE
+                result = cv2.rotate(result, rotate_code, dst=dst)
+            if flip_horizontal or flip_vertical:
+                flip_code = -1 if flip_horizontal and flip_vertical else (1 if flip_horizontal else 0)
+                result = cv2.flip(result, flip_code, dst=dst)
+            return result
+        
+        center = (w // 2, h // 2)
+        matrix = np.vstack([cv2.getRotationMatrix2D(center, angle, 1.0), [0, 0, 1]])
+        # Flips are applied after the rotation, so they left-multiply the matrix
+        if flip_horizontal:
+            matrix = np.array([[-1, 0, w - 1], [0, 1, 0], [0, 0, 1]]) @ matrix
+        if flip_vertical:
+            matrix = np.array([[1, 0, 0], [0, -1, h - 1], [0, 0, 1]]) @ matrix
+        # Reflect the border rather than leaving black corners
+        return cv2.warpAffine(image, matrix[:2], (w, h), dst=_scratch_buffer(scratch, 'warp', image.shape),
+                              flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT_101)
+    
+    @staticmethod
+    def color_matrix(image, brightness=1.0, contrast=1.0, saturation=1.0, bgr=False):
+        """Build the 3x4 RGB matrix applying brightness, contrast then saturation to image
+        
+        The factors may also be arrays, giving one matrix per set of factors.
+        With bgr=True the image and the matrix are in BGR order instead.
+        """
+        luma = _LUMA[::-1] if bgr else _LUMA
+        brightness = np.asarray(brightness, dtype=np.float32)[..., None, None]
+        contrast = np.asarray(contrast, dtype=np.float32)[..., None, None]
+        saturation = np.asarray(saturation, dtype=np.float32)[..., None, None]
+        mean = 0.0
+        if np.any(contrast != 1.0):
+            # Contrast blends towards the mean luminance of the brightened image
+            mean = brightness * np.dot(luma, cv2.mean(image)[:3])
+        # Saturation blends towards the luminance of each pixel; the blend keeps
+        # grey levels fixed, so the contrast offset passes through unchanged
+        linear = brightness * contrast * (saturation * np.eye(3) + (1.0 - saturation) * luma)
+        offset = np.broadcast_to((1.0 - contrast) * mean, linear.shape[:-1] + (1,))
+        return np.concatenate([linear, offset], axis=-1).astype(np.float32)
+    
+    @staticmethod
+    def color_transform(image, brightness=1.0, contrast=1.0, saturation=1.0, sharpness=1.0, scratch=None, bgr=False):
+        """Apply brightness, contrast, saturation and sharpness in one pass"""
+        result = image
+        dst = None
+        
+        # Brightness, contrast and saturation are all affine in RGB, so one matrix covers them
+        if brightness != 1.0 or contrast != 1.0 or saturation != 1.0:
+            dst = _scratch_buffer(scratch, 'color', image.shape)
+            matrix = AugmentationEngine.color_matrix(result, brightness, contrast, saturation, bgr)
+            result = cv2.transform(result, matrix, dst=dst)
+        
+        # Sharpness blends with a blurred copy: factors above 1 unsharp-mask the image
+        if sharpness != 1.0:
+            blurred = cv2.GaussianBlur(result, (0, 0), 1.0, dst=_scratch_buffer(scratch, 'smooth', image.shape))
+            if dst is None:
+                dst = _scratch_buffer(scratch, 'color', image.shape)
+            result = cv2.addWeighted(result, sharpness, blurred, 1.0 - sharpness, 0, dst=dst)
+        
+        return result
     
     @staticmethod
-    def add_gaussian_noise(image, sigma=15):
+    def add_gaussian_noise(image, sigma=15, scratch=None):
         """Add Gaussian noise to image"""
-        image_cv = pil_to_cv2(image)
-        row, col, ch = image_cv.shape
-        mean = 0
-        gauss = np.random.normal(mean, sigma, (row, col, ch))
-        noisy = image_cv + gauss
-        noisy = np.clip(noisy, 0, 255).astype(np.uint8)
-        return cv2_to_pil(noisy)
+        # int8 holds +/-8 sigma for the default strength, half the bytes of int16
+        noise = _scratch_buffer(scratch, 'noise', image.shape, np.int8 if 8 * sigma < 128 else np.int16)
+        # Fill through a flat view: a scalar sigma on a 3-channel buffer only reaches channel 0
+        cv2.randn(noise.reshape(-1), 0, sigma)
+        return cv2.add(image, noise, dst=_scratch_buffer(scratch, 'noisy', image.shape), dtype=cv2.CV_8U)
     
     @staticmethod
-    def gaussian_blur(image, kernel_size=5):
+    def gaussian_blur(image, kernel_size=5, scratch=None):
         """Apply Gaussian blur"""
-        return image.filter(ImageFilter.GaussianBlur(radius=kernel_size//2))
+        # PIL's radius is the sigma, and PIL extends edge pixels rather than reflecting
+        return cv2.GaussianBlur(image, (0, 0), sigmaX=kernel_size // 2,
+                                dst=_scratch_buffer(scratch, 'blur', image.shape),
+                                borderType=cv2.BORDER_REPLICATE)
     
     @staticmethod
-    def motion_blur(image, size=15):
+    def motion_blur(image, size=15, scratch=None):
         """Apply motion blur"""
-        image_cv = pil_to_cv2(image)
-        kernel_motion_blur = np.zeros((size, size))
-        kernel_motion_blur[int((size-1)/2), :] = np.ones(size)
-        kernel_motion_blur = kernel_motion_blur / size
-        blurred = cv2.filter2D(image_cv, -1, kernel_motion_blur)
-        return cv2_to_pil(blurred)
+        # The kernel is a single row of 1/size, i.e. a horizontal box filter
+        return cv2.blur(image, (size, 1), dst=_scratch_buffer(scratch, 'motion', image.shape))
     
     @staticmethod
     def pixelate(image, pixel_size=5):
         """Apply pixelation effect"""
-        small = image.resize(
-            (image.width // pixel_size, image.height // pixel_size),
-            Image.NEAREST
+        (h, w) = image.shape[:2]
+        pixel_size = max(1, min(pixel_size, h, w))
+        # Average whole blocks only, then stretch the last block over the remainder
+        h2, w2 = h - h % pixel_size, w - w % pixel_size
+        small = cv2.resize(
+            image[:h2, :w2],
+            (w2 // pixel_size, h2 // pixel_size),
+            interpolation=cv2.INTER_AREA
         )
-        return small.resize(image.size, Image.NEAREST)
\ No newline at end of file
+        blocks = cv2.resize(small, (w2, h2), interpolation=cv2.INTER_NEAREST)
+        return cv2.copyMakeBorder(blocks, 0, h - h2, 0, w - w2, cv2.BORDER_REPLICATE)
\ No newline at end of file
@@ -1,169 +1,342 @@
 """Batch image generation engine - creates multiple augmented versions from single image"""
 
+import multiprocessing
 import os
 import random
+import threading
 import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
-from PIL import Image
+import cv2
+import numpy as np
+from src.config.settings import settings
 from src.core.image_processor import ImageProcessor
 from src.utils.helpers import validate_file_format
 
+# Preset parameters that get a random variation per generated image
+_VARIED_PARAMS = ('rotation', 'brightness', 'contrast', 'saturation', 'sharpness')
+
+# Threads used to encode and write images in the background
+_IO_WORKERS = 4
+
+# Encoder flags per output format, one entry for each of settings.OUTPUT_FORMATS
+_ENCODE_PARAMS = {
+    'jpg': [cv2.IMWRITE_JPEG_QUALITY, settings.JPEG_QUALITY, cv2.IMWRITE_JPEG_OPTIMIZE, 0],
+    'png': [],
+}
+assert set(_ENCODE_PARAMS) == set(settings.OUTPUT_FORMATS), "encoder flags don't match OUTPUT_FORMATS"
+
+def _encode_and_write(image, output_path, output_format='jpg'):
+    """Encode a BGR array in the given format and write it to disk"""
+    ok, buffer = cv2.imencode(f'.{output_format}', image, _ENCODE_PARAMS[output_format])
+    if not ok:
+        raise ValueError(f"{output_format.upper()} encoding failed")
+    with open(output_path, 'wb') as f:
+        f.write(buffer)
+
+def _output_names(output_folder, base_name, output_format, count):
+    """Build the numbered filenames of a batch and their full output paths"""
+    name_template = f"{base_name}_{{:04d}}.{output_format}"
+    filenames = [name_template.format(i + 1) for i in range(count)]
+    output_folder = os.fspath(output_folder)
+    return filenames, [os.path.join(output_folder, filename) for filename in filenames]
+
+def _seed_opencv(seed):
+    """Seed OpenCV's RNG, which takes a signed 32-bit seed that seed + i can run past"""
+    cv2.setRNGSeed(seed & 0x7FFFFFFF)
+
+def _collect_write(index, future):
+    """Wait for a background write and report it as (index, success, error)"""
+    try:
+        future.result()
+        return index, True, None
+    except Exception as e:
+        return index, False, str(e)
+
 class BatchGenerator:
     """Generate multiple augmented versions from a single image"""
     
     def __init__(self):
         self.processor = ImageProcessor()
         self.settings = self.processor.settings
+        # Intermediate image buffers reused across the images of a batch, kept per
+        # thread since one generator may serve several Streamlit sessions. They are
+        # freed with the thread, and Streamlit runs each rerun on a new thread.
+        self._local = threading.local()
+        # Image encoding releases the GIL, so it overlaps with the next augmentation
+        self._io_pool = ThreadPoolExecutor(max_workers=_IO_WORKERS)
     
-    def generate_batch(self, original_image, count, output_folder, base_name="augmented", progress_callback=None):
+    @property
+    def _scratch(self):
+        """Scratch buffers of the calling thread, which live only as long as the thread"""
+        scratch = getattr(self._local, 'scratch', None)
+        if scratch is None:
+            scratch = self._local.scratch = {}
+        return scratch
+    
+    def generate_batch(self, original_image, count, output_folder, base_name="augmented", progress_callback=None, seed=None, max_workers=None, output_format='jpg'):
         """Generate multiple augmented versions of a single image"""
+        return self._run_batch(original_image, count, output_folder, base_name, progress_callback,
+                               seed=seed, max_workers=max_workers, output_format=output_format)
+    
+    def _generate_random_params_batch(self, rng, n):
+        """Generate random augmentation parameters for n images as arrays"""
+        return {
+            # Geometric transformations
+            'rotation': rng.integers(-30, 31, n),
+            'flip_horizontal': rng.random(n) < 0.5,
+            'flip_vertical': rng.random(n) < 0.5,
+            # Color adjustments
+            'brightness': rng.uniform(0.7, 1.3, n).round(2),
+            'contrast': rng.uniform(0.8, 1.2, n).round(2),
+            'saturation': rng.uniform(0.7, 1.3, n).round(2),
+            'sharpness': rng.uniform(0.8, 1.2, n).round(2),
+            # Effects
+            'gaussian_noise': rng.random(n) < 0.3,
+            'gaussian_blur': rng.random(n) < 0.2,
+            'motion_blur': rng.random(n) < 0.1,
+            'pixelate': rng.random(n) < 0.15
+        }
+    
+    def generate_with_preset(self, original_image, count, output_folder, preset_type, base_name="augmented", progress_callback=None, seed=None, max_workers=None, output_format='jpg'):
+        """Generate batch with specific preset variations"""
         
-        # Create output folder if it doesn't exist
-        Path(output_folder).mkdir(parents=True, exist_ok=True)
+        # Get preset parameters
+        preset_params = self.processor.get_preset_params(preset_type)
         
-        generated_count = 0
-        failed_count = 0
-        failed_files = []
+        return self._run_batch(original_image, count, output_folder, base_name, progress_callback,
+                               preset_params=preset_params, seed=seed, max_workers=max_workers,
+                               output_format=output_format)
+    
+    def generate_batch_vectorized(self, original_image, count, output_folder, base_name="augmented", progress_callback=None, seed=None, output_format='jpg', chunk_size=8):
+        """Generate a random batch chunk by chunk, sharing the work done on the base image
         
-        # Generate specified number of images
-        for i in range(count):
-            try:
-                # Call progress callback
-                if progress_callback:
-                    progress_callback(i + 1, count, f"{base_name}_{i+1:04d}.png")
-                
-                # Generate random augmentations
-                augmentation_params = self._generate_random_params()
-                
-                # Apply transformations
-                augmented_image = self.processor.apply_transformations(original_image, augmentation_params)
-                
-                # Save augmented image
-                filename = f"{base_name}_{i+1:04d}.png"
-                output_path = Path(output_folder) / filename
-                augmented_image.save(output_path, format="PNG")
-                
-                generated_count += 1
-                
-            except Exception as e:
-                failed_count += 1
-                failed_files.append((f"{base_name}_{i+1:04d}.png", str(e)))
-                print(f"Failed to generate {base_name}_{i+1:04d}.png: {str(e)}")
+        All parameters are sampled up front and the color matrices for the whole
+        batch are built in one go from the base image. Brightness, contrast and
+        saturation are therefore applied before the geometric transformations, with
+        the contrast mean taken from the base image rather than the rotated one.
+        """
+        original_image, seed, filenames, output_paths = self._prepare_batch(
+            original_image, count, output_folder, base_name, seed, output_format
+        )
+        _seed_opencv(seed)
+        batch_params = self._generate_random_params_batch(np.random.default_rng(seed), count)
+        results = self._generate_vectorized(original_image, output_paths, batch_params, output_format, chunk_size)
+        return self._summarize(results, filenames, progress_callback)
+    
+    def _generate_vectorized(self, original_image, output_paths, batch_params, output_format, chunk_size):
+        """Generate images into one stacked buffer per chunk, encoding them on the IO pool
         
-        return {
-            'requested': count,
-            'generated': generated_count,
-            'failed': failed_count,
-            'failed_files': failed_files
-        }
+        The base image is in BGR order. Yields (index, success, error) tuples.
+        """
+        matrices = self.processor.engine.color_matrix(
+            original_image, batch_params['brightness'], batch_params['contrast'], batch_params['saturation'],
+            bgr=True
+        )
+        pending = []
+        
+        for start in range(0, len(output_paths), chunk_size):
+            stop = min(start + chunk_size, len(output_paths))
+            stack = np.empty((stop - start,) + original_image.shape, dtype=np.uint8)
+            submitted = []
+            
+            for j, i in enumerate(range(start, stop)):
+                try:
+                    cv2.transform(original_image, matrices[i], dst=stack[j])
+                    
+                    augmentation_params = {key: values[i].item() for key, values in batch_params.items()}
+                    augmentation_params['brightness'] = augmentation_params['contrast'] = 1.0
+                    augmentation_params['saturation'] = 1.0
+                    augmented_image = self.processor.apply_transformations(
+                        stack[j], augmentation_params, scratch=self._scratch, bgr=True
+                    )
+                    np.copyto(stack[j], augmented_image)
+                    
+                    submitted.append((i, self._io_pool.submit(
+                        _encode_and_write, stack[j], output_paths[i], output_format
+                    )))
+                except Exception as e:
+                    yield i, False, str(e)
+            
+            # Keep at most two chunks alive: the one just filled and the one being written
+            for item in pending:
+                yield _collect_write(*item)
+            pending = submitted
+        
+        for item in pending:
+            yield _collect_write(*item)
     
-    def _generate_random_params(self):
-        """Generate random augmentation parameters"""
-        # Geometric transformations
-        rotation = random.randint(-30, 30)  # -30 to 30 degrees
-        flip_horizontal = random.choice([True, False])
-        flip_vertical = random.choice([True, False])
-        
-        # Color adjustments
-        brightness = round(random.uniform(0.7, 1.3), 2)  # 0.7 to 1.3
-        contrast = round(random.uniform(0.8, 1.2), 2)    # 0.8 to 1.2
-        saturation = round(random.uniform(0.7, 1.3), 2)  # 0.7 to 1.3
-        sharpness = round(random.uniform(0.8, 1.2), 2)   # 0.8 to 1.2
-        
-        # Effects (30% chance each)
-        gaussian_noise = random.random() < 0.3
-        gaussian_blur = random.random() < 0.2
-        motion_blur = random.random() < 0.1
-        pixelate = random.random() < 0.15
+    def _run_batch(self, original_image, count, output_folder, base_name, progress_callback,
+                   preset_params=None, seed=None, max_workers=None, output_format='jpg'):
+        """Generate images, in this process or across a pool of worker processes"""
+        original_image, seed, filenames, output_paths = self._prepare_batch(
+            original_image, count, output_folder, base_name, seed, output_format
+        )
+        max_workers = max(1, min(max_workers or os.cpu_count() or 1, count))
         
-        return {
-            'rotation': rotation,
-            'flip_horizontal': flip_horizontal,
-            'flip_vertical': flip_vertical,
-            'brightness': brightness,
-            'contrast': contrast,
-            'saturation': saturation,
-            'sharpness': sharpness,
-            'gaussian_noise': gaussian_noise,
-            'gaussian_blur': gaussian_blur,
-            'motion_blur': motion_blur,
-            'pixelate': pixelate
-        }
+        # Sample every image's parameters up front
+        if preset_params is None:
+            batch_params = self._generate_random_params_batch(np.random.default_rng(seed), count)
+            params_list = [
+                ({key: values[i].item() for key, values in batch_params.items()}, {})
+                for i in range(count)
+            ]
+        else:
+            rng = np.random.default_rng(seed)
+            params_list = [
+                (preset_params, dict(zip(_VARIED_PARAMS, self._vary_preset_params(preset_params, rng))))
+                for _ in range(count)
+            ]
+        
+        if max_workers == 1:
+            results = self._generate_in_process(original_image, output_paths, params_list, seed, output_format)
+        else:
+            results = self._generate_in_pool(original_image, output_paths, params_list, seed, output_format,
+                                             max_workers)
+        
+        return self._summarize(results, filenames, progress_callback)
     
-    def generate_with_preset(self, original_image, count, output_folder, preset_type, base_name="augmented", progress_callback=None):
-        """Generate batch with specific preset variations"""
+    def _prepare_batch(self, original_image, count, output_folder, base_name, seed, output_format):
+        """Validate a batch request and set up its output folder, seed, names and BGR base image
+        
+        Returns (original_image, seed, filenames, output_paths).
+        """
+        if output_format not in settings.OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output format. Supported: {settings.OUTPUT_FORMATS}")
         
         # Create output folder if it doesn't exist
         Path(output_folder).mkdir(parents=True, exist_ok=True)
         
+        if seed is None:
+            seed = random.randrange(2**31)
+        filenames, output_paths = _output_names(output_folder, base_name, output_format, count)
+        
+        # Work in the encoder's BGR order throughout, so the channels are swapped once per batch
+        original_image = cv2.cvtColor(original_image, cv2.COLOR_RGB2BGR)
+        return original_image, seed, filenames, output_paths
+    
+    def _summarize(self, results, filenames, progress_callback):
+        """Consume (index, success, error) results, reporting progress, and build the summary"""
         generated_count = 0
         failed_count = 0
         failed_files = []
         
-        # Get preset parameters
-        preset_params = self.processor.get_preset_params(preset_type)
-        
-        # Generate specified number of images
-        for i in range(count):
-            try:
-                # Call progress callback
-                if progress_callback:
-                    progress_callback(i + 1, count, f"{base_name}_{i+1:04d}.png")
-                
-                # Apply some random variation to preset
-                augmentation_params = self._vary_preset_params(preset_params, i)
-                
-                # Apply transformations
-                augmented_image = self.processor.apply_transformations(original_image, augmentation_params)
-                
-                # Save augmented image
-                filename = f"{base_name}_{i+1:04d}.png"
-                output_path = Path(output_folder) / filename
-                augmented_image.save(output_path, format="PNG")
-                
+        for done, (i, success, error) in enumerate(results, 1):
+            filename = filenames[i]
+            
+            # Call progress callback
+            if progress_callback:
+                progress_callback(done, len(filenames), filename)
+            
+            if success:
                 generated_count += 1
-                
-            except Exception as e:
+            else:
                 failed_count += 1
-                failed_files.append((f"{base_name}_{i+1:04d}.png", str(e)))
-                print(f"Failed to generate {base_name}_{i+1:04d}.png: {str(e)}")
+                failed_files.append((filename, error))
+                print(f"Failed to generate {filename}: {error}")
         
         return {
-            'requested': count,
+            'requested': len(filenames),
             'generated': generated_count,
             'failed': failed_count,
             'failed_files': failed_files
         }
     
-    def _vary_preset_params(self, preset_params, seed):
-        """Add random variations to preset parameters"""
-        import random
-        random.seed(seed)  # For reproducible variations
+    def _generate_in_process(self, original_image, output_paths, params_list, seed, output_format):
+        """Generate images here, encoding each one on the IO pool while the next is augmented
         
-        varied_params = preset_params.copy()
+        Yields (index, success, error) tuples. Writes are collected in index order,
+        but an image that fails to augment is reported straight away, ahead of
+        earlier images whose writes are still pending.
+        """
+        # One scratch dict per image in flight, so a buffer is only reused after its encode finished;
+        # the extra dicts are made per batch and their buffers are reused within it only
+        scratches = [self._scratch] + [{} for _ in range(_IO_WORKERS)]
+        pending = deque()
         
-        # Add small random variations
-        if 'rotation' in varied_params:
-            varied_params['rotation'] += random.randint(-10, 10)
-            varied_params['rotation'] = max(-180, min(180, varied_params['rotation']))
+        for i, output_path in enumerate(output_paths):
+            while pending and pending[0][0] <= i - len(scratches):
+                yield _collect_write(*pending.popleft())
+            try:
+                augmented_image = self._augment(original_image, *params_list[i], seed + i,
+                                                scratches[i % len(scratches)])
+                pending.append((i, self._io_pool.submit(
+                    _encode_and_write, augmented_image, output_path, output_format
+                )))
+            except Exception as e:
+                yield i, False, str(e)
         
-        if 'brightness' in varied_params:
-            varied_params['brightness'] *= random.uniform(0.9, 1.1)
-            varied_params['brightness'] = max(0.1, min(3.0, varied_params['brightness']))
+        while pending:
+            yield _collect_write(*pending.popleft())
+    
+    def _generate_in_pool(self, original_image, output_paths, params_list, seed, output_format, max_workers):
+        """Generate images across worker processes
         
-        if 'contrast' in varied_params:
-            varied_params['contrast'] *= random.uniform(0.95, 1.05)
-            varied_params['contrast'] = max(0.1, min(3.0, varied_params['contrast']))
+        Yields (index, success, error) tuples in completion order.
+        """
+        # Spawn rather than fork so workers start clean under Streamlit;
+        # the base image is pickled once per worker through the initializer
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=context,
+                                 initializer=_init_worker, initargs=(original_image,)) as executor:
+            futures = {
+                executor.submit(_generate_one, i, output_path, *params_list[i], seed + i, output_format): i
+                for i, output_path in enumerate(output_paths)
+            }
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # A worker that died or a result that failed to pickle fails only its image
+                    result = futures[future], False, str(e)
+                yield result
+    
+    def _augment(self, original_image, augmentation_params, overrides, seed, scratch=None):
+        """Apply one image's parameters to a BGR base image, seeding OpenCV so its noise is reproducible"""
+        _seed_opencv(seed)
+        return self.processor.apply_transformations(original_image, augmentation_params, scratch=scratch,
+                                                    bgr=True, **overrides)
+    
+    def _vary_preset_params(self, preset_params, rng):
+        """Draw random variations of a preset's parameters without touching the preset
         
-        if 'saturation' in varied_params:
-            varied_params['saturation'] *= random.uniform(0.9, 1.1)
-            varied_params['saturation'] = max(0.1, min(3.0, varied_params['saturation']))
+        Returns the (rotation, brightness, contrast, saturation, sharpness) values,
+        matching _VARIED_PARAMS; parameters the preset leaves out stay neutral.
+        """
+        rotation = preset_params.get('rotation', 0)
+        if 'rotation' in preset_params:
+            rotation = max(-180, min(180, rotation + int(rng.integers(-10, 11))))
         
-        if 'sharpness' in varied_params:
-            varied_params['sharpness'] *= random.uniform(0.95, 1.05)
-            varied_params['sharpness'] = max(0.1, min(3.0, varied_params['sharpness']))
+        factors = []
+        for key, spread in (('brightness', 0.1), ('contrast', 0.05), ('saturation', 0.1), ('sharpness', 0.05)):
+            value = preset_params.get(key, 1.0)
+            if key in preset_params:
+                value = max(0.1, min(3.0, value * float(rng.uniform(1 - spread, 1 + spread))))
+            factors.append(value)
         
-        return varied_params
+        return (rotation, *factors)
+
+# Per-process state for pool workers, set up once by _init_worker
+_worker_generator = None
+_worker_image = None
+
+def _init_worker(original_image):
+    """Initialize a pool worker with its own generator and the base image"""
+    global _worker_generator, _worker_image
+    _worker_generator = BatchGenerator()
+    _worker_image = original_image
+
+def _generate_one(index, output_path, augmentation_params, overrides, seed, output_format='jpg'):
+    """Generate and save a single augmented image inside a pool worker"""
+    try:
+        augmented_image = _worker_generator._augment(
+            _worker_image, augmentation_params, overrides, seed, _worker_generator._scratch
+        )
+        _encode_and_write(augmented_image, output_path, output_format)
+        return index, True, None
+    except Exception as e:
+        return index, False, str(e)
 
 class GenerationProgress:
     """Progress tracking for batch generation"""
@@ -1,8 +1,9 @@
 """Main image processing controller"""
 
+from collections import ChainMap
 from PIL import Image
 from src.core.augmentations import AugmentationEngine
-from src.utils.helpers import validate_file_format, resize_if_needed, validate_file_size
+from src.utils.helpers import validate_file_format, validate_file_size, draft_to_fit, pipeline
 from src.config.settings import settings
 
 class ImageProcessor:
@@ -13,9 +14,13 @@ class ImageProcessor:
         self.settings = settings
     
     def load_and_validate_image(self, file_obj):
-        """Load and validate image file"""
+        """Load and validate image file
+        
+        Returns the image as an RGB uint8 array, along with a dict of metadata
+        about the file as uploaded (format, mode and original size).
+        """
         # Validate file format
-        if not validate_file_format(file_obj.name, self.settings.SUPPORTED_FORMATS):
+        if not validate_file_format(file_obj.name, self.settings.SUPPORTED_FORMAT_SET):
             raise ValueError(f"Unsupported file format. Supported: {self.settings.SUPPORTED_FORMATS}")
         
         # Validate file size
@@ -25,53 +30,72 @@ class ImageProcessor:
         # Load image
         try:
             image = Image.open(file_obj)
-            return resize_if_needed(image, self.settings.MAX_IMAGE_SIZE)
+            meta = {'format': image.format, 'mode': image.mode, 'original_size': image.size}
+            # Large JPEGs decode straight at a reduced scale
+            draft_to_fit(image, self.settings.MAX_IMAGE_SIZE)
+            # Decode once; everything downstream works on this array
+            return pipeline(image, self.settings.MAX_IMAGE_SIZE), meta
         except Exception as e:
             raise ValueError(f"Invalid image file: {str(e)}")
     
-    def apply_transformations(self, image, params):
-        """Apply all selected transformations"""
-        result = image.copy()
-        
-        # Geometric transformations
-        if params.get('rotation', 0) != 0:
-            result = self.engine.rotate(result, params['rotation'])
+    def apply_transformations(self, image, params, scratch=None, bgr=False, **overrides):
+        """Apply all selected transformations
         
-        if params.get('flip_horizontal'):
-            result = self.engine.flip_horizontal(result)
+        Keyword overrides take precedence over the matching entries of params,
+        so callers can vary a few values without copying the whole dict.
         
-        if params.get('flip_vertical'):
-            result = self.engine.flip_vertical(result)
+        When a scratch dict is given, intermediate buffers are kept in it and
+        reused across calls, so the returned array may be overwritten by the
+        next call with the same scratch dict.
         
-        # Color adjustments
-        if params.get('brightness', 1.0) != 1.0:
-            result = self.engine.adjust_brightness(result, params['brightness'])
+        With bgr=True the image is in BGR order, and so is the result.
+        """
+        if overrides:
+            params = ChainMap(overrides, params)
         
-        if params.get('contrast', 1.0) != 1.0:
-            result = self.engine.adjust_contrast(result, params['contrast'])
+        # Every operation returns a new array, so only copy if none of them ran
+        result = image
         
-        if params.get('saturation', 1.0) != 1.0:
-            result = self.engine.adjust_saturation(result, params['saturation'])
+        # Geometric transformations, fused into one warp
+        result = self.engine.geometric_transform(
+            result,
+            params.get('rotation', 0),
+            params.get('flip_horizontal', False),
+            params.get('flip_vertical', False),
+            scratch=scratch
+        )
         
-        if params.get('sharpness', 1.0) != 1.0:
-            result = self.engine.adjust_sharpness(result, params['sharpness'])
+        # Color adjustments
+        result = self.engine.color_transform(
+            result,
+            params.get('brightness', 1.0),
+            params.get('contrast', 1.0),
+            params.get('saturation', 1.0),
+            params.get('sharpness', 1.0),
+            scratch=scratch,
+            bgr=bgr
+        )
         
         # Effects
         if params.get('gaussian_noise'):
-            result = self.engine.add_gaussian_noise(result)
+            result = self.engine.add_gaussian_noise(result, scratch=scratch)
         
         if params.get('gaussian_blur'):
-            result = self.engine.gaussian_blur(result)
+            result = self.engine.gaussian_blur(result, scratch=scratch)
         
         if params.get('motion_blur'):
-            result = self.engine.motion_blur(result)
+            result = self.engine.motion_blur(result, scratch=scratch)
         
         if params.get('pixelate'):
             result = self.engine.pixelate(result)
         
+        if result is image:
+            return image.copy()
         return result
     
     def get_preset_params(self, preset_name):
-        """Get parameters for a preset configuration"""
-        preset = self.settings.PRESETS.get(preset_name.lower())
-        return preset.copy() if preset else {}
\ No newline at end of file
+        """Get parameters for a preset configuration
+        
+        The returned dict is the shared settings entry and must not be modified.
+        """
+        return self.settings.PRESETS.get(preset_name.lower(), {})
\ No newline at end of file
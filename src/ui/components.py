@@ -173,11 +173,10 @@ def render_image_comparison(original, augmented):
 
 def render_download_button(augmented_image):
     """Render download button for augmented image"""
-    import io
+    import cv2
     
-    buf = io.BytesIO()
-    augmented_image.save(buf, format="PNG")
-    byte_im = buf.getvalue()
+    _, buf = cv2.imencode('.png', cv2.cvtColor(augmented_image, cv2.COLOR_RGB2BGR))
+    byte_im = buf.tobytes()
     
     st.download_button(
         label="💾 Download Augmented Image",
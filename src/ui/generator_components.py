@@ -5,6 +5,12 @@ import os
 from pathlib import Path
 from src.core.batch_generator import BatchGenerator, GenerationProgress
 from src.ui.components import render_augmentation_controls
+from src.config.settings import settings
+
+@st.cache_resource
+def get_generator():
+    """Get the batch generator shared across reruns, so its IO thread pool is started once"""
+    return BatchGenerator()
 
 def render_generation_interface():
     """Render batch generation interface"""
@@ -20,19 +26,23 @@ def render_generation_interface():
     
     if uploaded_file is not None:
         try:
-            # Initialize generator
-            generator = BatchGenerator()
+            # Get the shared generator
+            generator = get_generator()
             
             # Load and validate image
-            original_image = generator.processor.load_and_validate_image(uploaded_file)
+            original_image, image_meta = generator.processor.load_and_validate_image(uploaded_file)
             
             st.success("✅ Image loaded successfully!")
             st.image(original_image, caption="Base Image", width=300)
+            height, width = original_image.shape[:2]
+            if (width, height) != image_meta['original_size']:
+                orig_width, orig_height = image_meta['original_size']
+                st.caption(f"Resized from {orig_width}x{orig_height} to {width}x{height}")
             
             # Generation settings
             st.subheader("⚙️ Generation Settings")
             
-            col1, col2, col3 = st.columns(3)
+            col1, col2, col3, col4 = st.columns(4)
             
             with col1:
                 count = st.number_input(
@@ -58,6 +68,14 @@ def render_generation_interface():
                     key="gen_preset"
                 )
             
+            with col4:
+                output_format = st.selectbox(
+                    "Output Format",
+                    settings.OUTPUT_FORMATS,
+                    format_func=str.upper,
+                    key="gen_output_format"
+                )
+            
             # Output folder
             output_folder = st.text_input(
                 "Output Folder Path",
@@ -103,7 +121,8 @@ def render_generation_interface():
                                 count,
                                 output_folder,
                                 base_name,
-                                progress_callback
+                                progress_callback,
+                                output_format=output_format
                             )
                         else:
                             result = generator.generate_with_preset(
@@ -112,7 +131,8 @@ def render_generation_interface():
                                 output_folder,
                                 preset_type.lower().replace(" ", "_"),
                                 base_name,
-                                progress_callback
+                                progress_callback,
+                                output_format=output_format
                             )
                     
                     # Clear progress indicators
@@ -157,6 +177,7 @@ Batch Generation Summary:
 - Failed: {result['failed']}
 - Output folder: {output_folder}
 - Preset used: {preset_type}
+- Output format: {output_format.upper()}
                     """
                     
                     st.download_button(
@@ -210,7 +231,7 @@ def render_generation_tips():
         - Close other applications during generation
         
         ### Output Organization:
-        - Files are named: `basename_0001.png`, `basename_0002.png`, etc.
-        - All files are saved in PNG format for quality
+        - Files are named: `basename_0001.jpg`, `basename_0002.jpg`, etc.
+        - JPG is the default and much smaller; pick PNG when you need lossless output
         - Output folder is created automatically if it doesn't exist
         """)
\ No newline at end of file
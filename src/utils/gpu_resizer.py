@@ -0,0 +1,45 @@
+"""Batch resizing on a CUDA device through OpenCV's CUDA module"""
+
+import cv2
+from src.utils.helpers import resize_batch, target_dims
+
+def cuda_available():
+    """Check if OpenCV was built with CUDA and can see a device"""
+    return hasattr(cv2, 'cuda') and hasattr(cv2.cuda, 'resize') and cv2.cuda.getCudaEnabledDeviceCount() > 0
+
+class GPUResizer:
+    """Resize batches of image arrays to fit within max_size on the GPU
+    
+    Needs an OpenCV build with CUDA; the opencv-python-headless wheel has none,
+    in which case every batch goes through resize_batch on the CPU.
+    """
+    
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.use_gpu = cuda_available()
+        if self.use_gpu:
+            self._stream = cv2.cuda.Stream()
+    
+    def resize(self, images):
+        """Resize a list of image arrays, returning them in the same order"""
+        if not self.use_gpu:
+            return resize_batch(images, self.max_size)
+        
+        # Queue every upload, resize and download on one stream and wait once at the end.
+        # The host arrays are pageable numpy memory, so the copies don't run asynchronously
+        results = []
+        device_images = []
+        for image in images:
+            height, width = image.shape[:2]
+            if width <= self.max_size and height <= self.max_size:
+                results.append(image)
+                continue
+            source = cv2.cuda_GpuMat()
+            source.upload(image, stream=self._stream)
+            resized = cv2.cuda.resize(source, target_dims(width, height, self.max_size),
+                                      interpolation=cv2.INTER_AREA, stream=self._stream)
+            # Keep the device buffers alive until the stream has finished with them
+            device_images.append((source, resized))
+            results.append(resized.download(stream=self._stream))
+        self._stream.waitForCompletion()
+        return results
@@ -1,37 +1,146 @@
 """Utility functions for image processing"""
 
+import functools
 import numpy as np
 from PIL import Image
 import cv2
 import os
 
-def pil_to_cv2(pil_image):
-    """Convert PIL Image to OpenCV format"""
-    return cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
+def pil_to_cv2(pil_image, mode='BGR'):
+    """Convert PIL Image to OpenCV format
+    
+    mode is 'BGR' for a 3-channel image, or 'GRAY' for a single-channel
+    image when only the intensity is needed.
+    """
+    if mode not in ('BGR', 'GRAY'):
+        raise ValueError(f"Unsupported mode: {mode}")
+    if mode == 'GRAY':
+        if pil_image.mode == 'L':
+            return np.array(pil_image)
+        return cv2.cvtColor(np.asarray(pil_image), cv2.COLOR_RGB2GRAY)
+    # asarray copies the pixels out of PIL once, and cvtColor then copies and
+    # swaps the channels in a single pass, instead of np.array plus a swap
+    return cv2.cvtColor(np.asarray(pil_image), cv2.COLOR_RGB2BGR)
 
 def cv2_to_pil(cv2_image):
     """Convert OpenCV image to PIL format"""
+    # cvtColor copies and swaps in one pass; handing PIL a reversed view is far slower
     return Image.fromarray(cv2.cvtColor(cv2_image, cv2.COLOR_BGR2RGB))
 
 def validate_file_format(filename, supported_formats):
-    """Check if file format is supported"""
+    """Check if file format is supported
+    
+    supported_formats should be a set of lowercase extensions, for constant-time lookup.
+    """
     if not filename:
         return False
-    extension = os.path.splitext(filename.lower())[1][1:]
-    return extension in supported_formats
+    # Only the extension needs lowercasing, not the whole path
+    dot = filename.rfind('.')
+    return dot >= 0 and filename[dot + 1:].lower() in supported_formats
 
-def resize_if_needed(image, max_size):
-    """Resize image if it exceeds maximum dimensions"""
+def validate_file_formats(filenames, supported_formats):
+    """Check a whole list of filenames at once, returning one bool per filename"""
+    # Any collection of extensions will do; normalize it once for the whole list
+    supported_formats = frozenset(map(str.lower, supported_formats))
+    results = []
+    for filename in filenames:
+        _, dot, extension = (filename or '').rpartition('.')
+        results.append(bool(dot) and extension.lower() in supported_formats)
+    return results
+
+# PIL filter per resize quality; 'fast' uses OpenCV's area averaging instead
+_QUALITY_FILTERS = {'fast': None, 'balanced': Image.Resampling.BICUBIC, 'best': Image.Resampling.LANCZOS}
+
+@functools.lru_cache(maxsize=1024)
+def target_dims(width, height, max_size):
+    """Dimensions of an oversized image scaled down to fit within max_size"""
+    # The longer side sets the ratio, so a single division is enough
+    ratio = max_size / max(width, height)
+    return int(width * ratio), int(height * ratio)
+
+def resize_if_needed(image, max_size, quality='fast'):
+    """Resize image array or PIL Image if it exceeds maximum dimensions
+    
+    quality is 'fast' for OpenCV's area averaging, 'balanced' for PIL's bicubic
+    filter, or 'best' for PIL's Lanczos filter, the slowest of the three.
+    """
+    if quality not in _QUALITY_FILTERS:
+        raise ValueError(f"Unknown resize quality: {quality}. Supported: {list(_QUALITY_FILTERS)}")
+    
+    if isinstance(image, Image.Image):
+        width, height = image.size
+        if width <= max_size and height <= max_size:
+            return image
+        # Stay in RGB; palette indices can't be averaged
+        if image.mode not in ('L', 'RGB', 'RGBA'):
+            image = image.convert('RGB')
+        # PIL's filters are SIMD-accelerated under Pillow-SIMD
+        if quality != 'fast':
+            return image.resize(target_dims(width, height, max_size), _QUALITY_FILTERS[quality])
+        return Image.fromarray(resize_if_needed(np.asarray(image), max_size, quality))
+    
+    height, width = image.shape[:2]
+    if width <= max_size and height <= max_size:
+        return image
+    
+    new_width, new_height = target_dims(width, height, max_size)
+    if quality != 'fast':
+        return np.asarray(Image.fromarray(image).resize((new_width, new_height), _QUALITY_FILTERS[quality]))
+    # Area averaging is the cheap, alias-free choice for shrinking
+    return cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_AREA)
+
+def resize_batch(images, max_size, quality='fast'):
+    """Resize a list of image arrays to fit within max_size, keeping their order
+    
+    Each image is resized on its own, in its interleaved layout, like resize_if_needed.
+    """
+    return [resize_if_needed(image, max_size, quality) for image in images]
+
+def draft_to_fit(image, max_size):
+    """Ask the decoder of a PIL Image, before it loads, for a reduced size that still covers max_size
+    
+    JPEGs then decode at 1/2, 1/4 or 1/8 scale, skipping most of the IDCT work;
+    other formats are left as they are.
+    """
     width, height = image.size
-    if width > max_size or height > max_size:
-        ratio = min(max_size/width, max_size/height)
-        new_width = int(width * ratio)
-        new_height = int(height * ratio)
-        return image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+    if width <= max_size and height <= max_size:
+        return image
+    image.draft('RGB', target_dims(width, height, max_size))
     return image
 
+def pipeline(pil_image, max_size, as_pil=False, quality='fast'):
+    """Turn a PIL Image into an RGB uint8 array no larger than max_size, or a PIL Image with as_pil
+    
+    The pixels are copied out of PIL once and resized at most once; as_pil copies
+    them back into a new Image. Resizing and the augmentations don't care about
+    channel order, so there is no BGR round trip.
+    """
+    # convert() copies even when the mode already matches
+    if pil_image.mode != 'RGB':
+        pil_image = pil_image.convert('RGB')
+    image = resize_if_needed(np.asarray(pil_image), max_size, quality)
+    return Image.fromarray(image) if as_pil else image
+
+def load_and_resize(fp, max_size, quality='fast'):
+    """Load an image file as an RGB uint8 array no larger than max_size"""
+    with Image.open(fp) as image:
+        draft_to_fit(image, max_size)
+        return pipeline(image, max_size, quality=quality)
+
 def validate_file_size(file_obj, max_size):
     """Check if file size is within limits"""
+    # In-memory streams, Streamlit uploads included, expose their buffer without a copy;
+    # release the view right away, as a BytesIO can't be resized while it is exported
+    if hasattr(file_obj, 'getbuffer'):
+        with file_obj.getbuffer() as buffer:
+            return len(buffer) <= max_size
+    
+    # Real files: one fstat, without moving the stream position
+    try:
+        return os.fstat(file_obj.fileno()).st_size <= max_size
+    except (AttributeError, OSError):
+        pass
+    
     file_obj.seek(0, 2)  # Seek to end
     file_size = file_obj.tell()
     file_obj.seek(0)  # Reset to beginning